@@ -2,6 +2,14 @@ from setuptools import find_packages
 from setuptools import setup
 from z80count.z80count import version
 
+# the compiled speedups are optional; the pure python implementations
+# are used if Cython is not available
+try:
+    from Cython.Build import cythonize
+    ext_modules = cythonize(["z80count/_speedups.pyx"])
+except ImportError:
+    ext_modules = []
+
 
 def readme():
     try:
@@ -30,6 +38,7 @@ setup(
     url="https://github.com/reidrac/z80count",
     license="MIT",
     packages=find_packages(),
+    ext_modules=ext_modules,
     include_package_data=True,
     zip_safe=False,
     install_requires=[
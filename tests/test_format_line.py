@@ -2,6 +2,7 @@
 
 import pytest
 
+from z80count.z80count import Entry
 from z80count.z80count import comment_alignment
 from z80count.z80count import format_line
 from z80count.z80count import line_length
@@ -102,10 +103,7 @@ def test_comment_alignment_with_spaces(line, column, expected):
 
 
 def _make_entry(cycles, case=""):
-    return {
-        "cycles": cycles,
-        "case": case,
-    }
+    return Entry(cycles=cycles, case=case)
 
 
 def _run(line, cycles, total=0, total_cond=0, case="", subt=False,
@@ -915,7 +915,7 @@ def parser_table():
 def test_lookup(instruction, cycles, parser_table):
     entry = parser_table.lookup(instruction)
     assert entry is not None, "Not found: {}".format(instruction)
-    assert entry["cycles"] == cycles, "Failed: {} expected '{}' != found '{}'".format(instruction, cycles, entry["cycles"])
+    assert entry.cycles == cycles, "Failed: {} expected '{}' != found '{}'".format(instruction, cycles, entry.cycles)
 
 
 ##########################################################################
@@ -1,13 +1,11 @@
 # -*- coding: utf-8 -*-
 
+from z80count.z80count import Entry
 from z80count.z80count import update_counters
 
 
 def _make_entry(states, states_met=0):
-    return {
-        "_t_states_met": states_met,
-        "_t_states_or_not_met": states,
-    }
+    return Entry(t_met=states_met, t_notmet=states)
 
 
 def test_unconditional_instruction():
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# cython: language_level=3, boundscheck=False, wraparound=False
+
+"""Optional compiled versions of the per-line helpers.
+
+Only built if Cython is available at install time; z80count falls back
+to the pure python implementations otherwise.
+"""
+
+
+def line_length(str line, int tab_width):
+    """Calculate the length of a line taking TABs into account."""
+    cdef int length = 0
+    cdef Py_UCS4 ch
+    for ch in line:
+        if ch == u"\t":
+            length = ((length + tab_width) // tab_width) * tab_width
+        else:
+            length += 1
+    return length
+
+
+def comment_alignment(str line, int column, bint use_tabs=False,
+                      int tab_width=8):
+    """Calculate the spacing required for comment alignment."""
+    cdef int expected_length = column - 1
+    cdef int length = line_length(line, tab_width)
+    cdef int tab_stop, extra_tabs, extra_spaces
+
+    if length >= expected_length:
+        return " "  # add an space before the colon
+
+    if use_tabs:
+        tab_stop = (expected_length // tab_width) * tab_width + 1
+        if tab_stop > length:
+            extra_tabs = (tab_stop - length) // tab_width
+            if length % tab_width > 1:
+                extra_tabs += 1  # complete partial tab
+            extra_spaces = expected_length - tab_stop
+        else:
+            extra_tabs = 0
+            extra_spaces = expected_length - length
+    else:
+        extra_tabs = 0
+        extra_spaces = expected_length - length
+
+    return "\t" * extra_tabs + " " * extra_spaces
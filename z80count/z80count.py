@@ -21,8 +21,10 @@
 # THE SOFTWARE.
 #
 
+import bisect
 import collections
 import configparser
+import functools
 import json
 import sys
 import os
@@ -35,6 +37,7 @@ version = "0.8.1"
 OUR_COMMENT = re.compile(r"(\[[0-9.\s/]+\])")
 DEF_COLUMN = 50
 DEF_TABSTOP = 8
+DEF_JOBS = 1
 DEF_CONFIG_FILE = "z80countrc"
 
 
@@ -72,6 +75,7 @@ Option = collections.namedtuple(
 DEFAULTS = [
     Option("column",    "column",    DEF_COLUMN,  int),
     Option("debug",     "debug",     False,       boolean),
+    Option("jobs",      "jobs",      DEF_JOBS,    int),
     Option("subtotals", "subt",      False,       boolean),
     Option("tab width", "tab_width", DEF_TABSTOP, int),
     Option("keep cycles", "no_update", False,     boolean),
@@ -96,7 +100,11 @@ def get_program_args():
     """
     config_file = locate_config_file()
     if config_file:
-        config = load_config_file(config_file, DEFAULTS)
+        try:
+            mtime_ns = os.stat(config_file).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        config = _load_config_file_cached(config_file, mtime_ns)
     else:
         config = {i.config_name: i.default for i in DEFAULTS}
 
@@ -107,18 +115,21 @@ def get_program_args():
     return args
 
 
+@functools.lru_cache(maxsize=None)
+def _load_config_file_cached(config_file, mtime_ns):
+    # mtime_ns is part of the key just to invalidate the cache if the
+    # file changes while the process is running.
+    return load_config_file(config_file, DEFAULTS)
+
+
 def load_config_file(config_file, schema):
-    parser = configparser.ConfigParser()
-    parser["z80count"] = {i.config_name: i.default for i in schema}
-    try:
-        parser.read(config_file)
-    except configparser.Error as ex:
-        perror("Error parsing config file. Using defaults.", exc=ex)
+    values = _fast_read_ini(config_file)
+    if values is None:
+        values = _configparser_read(config_file, schema)
 
-    section = parser["z80count"]
     res = {}
     for opt in schema:
-        v = section.get(opt.config_name)
+        v = values.get(opt.config_name, opt.default)
         try:
             v = opt.type(v)
         except (ValueError, TypeError):
@@ -132,16 +143,69 @@ def load_config_file(config_file, schema):
     return res
 
 
+def _fast_read_ini(config_file):
+    """Direct parse of the simple "key = value" config file format.
+
+    Much cheaper than spinning up a full configparser for the handful
+    of options z80count supports. Returns a dict of raw string values,
+    or None if the file uses something this parser doesn't understand
+    (the caller then falls back to configparser).
+    """
+    try:
+        with open(config_file, "rt") as fd:
+            data = fd.read()
+    except OSError:
+        return None
+
+    res = {}
+    in_section = False
+    for line in data.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line[0] == "[":
+            if line != "[z80count]":
+                return None
+            in_section = True
+            continue
+        if not in_section:
+            # a value before the section header is an error for
+            # configparser, let it report it
+            return None
+        key, sep, value = line.partition("=")
+        if not sep:
+            return None
+        res[key.strip().lower()] = value.strip()
+    return res
+
+
+def _configparser_read(config_file, schema):
+    parser = configparser.ConfigParser()
+    parser["z80count"] = {i.config_name: i.default for i in schema}
+    try:
+        parser.read(config_file)
+    except configparser.Error as ex:
+        perror("Error parsing config file. Using defaults.", exc=ex)
+
+    return dict(parser["z80count"])
+
+
 def locate_config_file():
+    return _locate_config_file(
+        os.environ.get("Z80COUNT_RC"),
+        os.environ.get("XDG_CONFIG_HOME"),
+        os.path.expanduser("~"),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _locate_config_file(z80count_rc, xdg_config_home, home_dir):
 
     # TODO: check on windows
 
-    z80count_rc = os.environ.get("Z80COUNT_RC")
     if z80count_rc and os.path.isfile(z80count_rc):
         return z80count_rc
 
-    home_dir = os.path.expanduser("~")
-
     # NOTE: The XDG standard states:
     #
     # $XDG_CONFIG_HOME defines the base directory relative to which
@@ -151,7 +215,6 @@ def locate_config_file():
     #
     # https://specifications.freedesktop.org/basedir-spec/latest/ar01s03.html
 
-    xdg_config_home = os.environ.get("XDG_CONFIG_HOME")
     if xdg_config_home is None:
         xdg_config_home = os.path.join(home_dir, ".config")
 
@@ -167,6 +230,83 @@ def locate_config_file():
 
 
 def parse_command_line(defaults):
+    args = _fast_parse_command_line(defaults, sys.argv[1:])
+    if args is not None:
+        return args
+    return _argparse_command_line(defaults)
+
+
+def _fast_parse_command_line(defaults, argv):
+    """Hand-rolled parser for the common command lines.
+
+    argparse builds a sizeable object graph on every run, which is
+    noticeable for short jobs. This recognizes the fixed flag set
+    directly and returns None for anything it doesn't handle
+    (--help, --version, clustered or unknown flags, "key=value"
+    forms), in which case the caller falls back to argparse so its UX
+    is preserved.
+    """
+    flags = {
+        "-d": "debug",
+        "-s": "subt",
+        "-n": "no_update",
+        "-t": "use_tabs",
+        "--use-tabs": "use_tabs",
+    }
+    options = {
+        "-T": "tab_width",
+        "-c": "column",
+        "--column": "column",
+        "-j": "jobs",
+        "--jobs": "jobs",
+    }
+
+    values = dict(defaults)
+    positional = []
+    i = 0
+    n = len(argv)
+    while i < n:
+        arg = argv[i]
+        if arg in flags:
+            if positional:
+                # argparse rejects options after the positionals, let
+                # it report the error
+                return None
+            values[flags[arg]] = True
+        elif arg in options:
+            if positional:
+                return None
+            i += 1
+            if i == n:
+                return None  # missing value, let argparse report it
+            try:
+                values[options[arg]] = int(argv[i])
+            except ValueError:
+                return None
+        elif arg.startswith("-") and arg != "-":
+            return None
+        else:
+            positional.append(arg)
+        i += 1
+
+    if len(positional) > 2:
+        return None
+    try:
+        # "-" means stdin/stdout, like argparse.FileType
+        if positional and positional[0] != "-":
+            values["infile"] = open(positional[0], "r")
+        else:
+            values["infile"] = sys.stdin
+        if len(positional) > 1 and positional[1] != "-":
+            values["outfile"] = open(positional[1], "w")
+        else:
+            values["outfile"] = sys.stdout
+    except OSError:
+        return None  # let argparse produce the error message
+    return argparse.Namespace(**values)
+
+
+def _argparse_command_line(defaults):
     parser = argparse.ArgumentParser(
         description='Z80 Cycle Count',
         epilog="Copyright (C) 2019 Juan J Martinez <jjm@usebox.net>")
@@ -191,6 +331,11 @@ def parse_command_line(defaults):
     parser.add_argument('-c', '--column', dest='column', type=int,
                         help="Column to align newly added comments (default: %d)" % DEF_COLUMN,
                         default=defaults["column"])
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+                        help="Number of processes used to annotate the input "
+                             "in parallel (default: %d); only effective "
+                             "without -s" % DEF_JOBS,
+                        default=defaults["jobs"])
 
     parser.add_argument(
         "infile", nargs="?", type=argparse.FileType('r'), default=sys.stdin,
@@ -217,6 +362,11 @@ def z80count(line,
              debug=False,
              ):
     out = line.rstrip() + "\n"
+    # don't bother the regex machinery with lines that cannot contain
+    # an instruction (blanks and comment-only lines)
+    stripped = line.lstrip()
+    if not stripped or stripped[0] == ";":
+        return (out, total)
     entry = parser.lookup(line)
     if entry:
         total, total_cond = update_counters(entry, total)
@@ -229,44 +379,42 @@ def z80count(line,
 
 
 def update_counters(entry, total):
-    if entry["_t_states_met"]:
-        total_cond = total + entry["_t_states_met"]
+    t_states_met = entry.t_met
+    if t_states_met:
+        total_cond = total + t_states_met
     else:
         total_cond = 0
-    total = total + entry["_t_states_or_not_met"]
+    total = total + entry.t_notmet
 
     return (total, total_cond)
 
 
 def format_line(line, entry, total, total_cond, subt, update, column,
                 debug, use_tabs, tab_width):
-    cycles = entry["cycles"]
-    line = line.rstrip().rsplit(";", 1)
-    comment = "; [%s" % cycles
+    code, sep, old_comment = line.rstrip().rpartition(";")
+    parts = ["; [", entry.cycles]
     if subt:
         if total_cond:
-            comment += " .. %d/%d]" % (total_cond, total)
+            parts.append(" .. %d/%d]" % (total_cond, total))
         else:
-            comment += " .. %d]" % total
+            parts.append(" .. %d]" % total)
     else:
-        comment += "]"
+        parts.append("]")
     if debug:
-        comment += " case{%s}" % entry["case"]
+        parts.append(" case{%s}" % entry.case)
+    comment = "".join(parts)
 
-    if len(line) == 1:
+    if not sep:
+        # with no separator rpartition leaves the whole line in the
+        # last element
+        code = old_comment
         comment = comment_alignment(
-            line[0], column, use_tabs, tab_width) + comment
-    out = line[0] + comment
-    if len(line) > 1:
-        if update:
-            m = OUR_COMMENT.search(line[1])
-            if m:
-                line[1] = line[1].replace(m.group(0), "")
-        out += " "
-        out += line[1].lstrip()
-    out += "\n"
+            code, column, use_tabs, tab_width) + comment
+        return code + comment + "\n"
 
-    return out
+    if update:
+        old_comment = OUR_COMMENT.sub("", old_comment, count=1)
+    return code + comment + " " + old_comment.lstrip() + "\n"
 
 
 def comment_alignment(line, column, use_tabs=False, tab_width=8):
@@ -281,9 +429,15 @@ def comment_alignment(line, column, use_tabs=False, tab_width=8):
     :rtype: str
 
     """
+    return _alignment_from_length(
+        line_length(line, tab_width), column, use_tabs, tab_width)
 
+
+@functools.lru_cache(maxsize=256)
+def _alignment_from_length(length, column, use_tabs, tab_width):
+    # only the length of the code portion matters, and line lengths
+    # cluster tightly in real sources, so this caches very well
     expected_length = column - 1
-    length = line_length(line, tab_width)
     if length >= expected_length:
         return " "  # add an space before the colon
 
@@ -314,13 +468,52 @@ def line_length(line, tab_width):
     :rtype: int
 
     """
-    length = 0
-    for i in line:
-        if i == "\t":
-            length = ((length + tab_width) // tab_width) * tab_width
-        else:
-            length += 1
-    return length
+    if "\t" not in line:
+        return len(line)
+    return len(line.expandtabs(tab_width))
+
+
+# optional compiled versions of the helpers above (only built if
+# Cython was available at install time)
+try:
+    from z80count._speedups import comment_alignment, line_length  # noqa: F401,F811
+except ImportError:
+    pass
+
+
+# compiled table cache, shared by all Parser instances of the process,
+# keyed by (path, mtime) so a modified table is picked up
+_TABLE_CACHE = {}
+
+# all the entries of a mnemonic, plus a single regex combining the
+# entries' regexes as alternatives (in entry order); starts[i] is the
+# number of entry i's outer group within the combined regex, so a
+# match can be mapped back to its entry. Buckets are built lazily, on
+# the first lookup of their mnemonic; until then the table holds the
+# plain entry list.
+_Bucket = collections.namedtuple("_Bucket", "entries, combined, starts")
+
+
+class Entry(object):
+
+    """A single entry of the instruction table.
+
+    Slotted for compact storage and fast attribute access in the
+    per-line hot path.
+    """
+
+    __slots__ = ("regex", "cycles", "case", "w",
+                 "t_met", "t_notmet", "hits")
+
+    def __init__(self, regex=None, cycles=None, case="",
+                 w=0, t_met=0, t_notmet=0):
+        self.regex = regex
+        self.cycles = cycles
+        self.case = case
+        self.w = w
+        self.t_met = t_met
+        self.t_notmet = t_notmet
+        self.hits = 0
 
 
 class Parser(object):
@@ -328,60 +521,116 @@ class Parser(object):
     """Simple parser based on a table of regexes."""
 
     # [label:] OPERATOR [OPERANDS] [; comment]
-    _LINE_RE = re.compile(r"^([$.\w]+:)?\s*(?P<operator>\w+)(?P<rest>\s+.*)?$")
+    #
+    # The label group is non-capturing and the whitespace classes are
+    # explicit to limit backtracking; re.ASCII keeps \w a plain byte
+    # class (assembler sources are ASCII).
+    _LINE_RE = re.compile(
+        r"^(?:[$.\w]+:)?[ \t]*(?P<operator>\w+)(?P<rest>[ \t].*)?$",
+        re.ASCII)
+
+    # successful lookups before the buckets are re-sorted by observed
+    # frequency (warm-up pass, done only once)
+    REORDER_AFTER = 4096
 
     def __init__(self):
         self._table = self._load_table()
+        self._hits = 0
 
     def lookup(self, line):
-        mnemo = self._extract_mnemonic(line)
-        line = self._remove_label(line)
-        if mnemo is None or mnemo not in self._table:
+        mnemo, line = self._parse_line(line)
+        if mnemo is None:
             return None
-        for entry in self._table[mnemo]:
-            if "_initialized" not in entry:
-                self._init_entry(entry)
-            if entry["cregex"].search(line):
-                return entry
+        bucket = self._table.get(mnemo)
+        if bucket is None:
+            return None
+        if isinstance(bucket, list):
+            bucket = self._make_bucket(bucket)
+            self._table[mnemo] = bucket
+        match = bucket.combined.match(line)
+        if match:
+            index = bisect.bisect_right(bucket.starts, match.lastindex) - 1
+            entry = bucket.entries[index]
+            entry.hits += 1
+            self._hits += 1
+            if self._hits == self.REORDER_AFTER:
+                self._reorder()
+            return entry
         return None
 
+    def _reorder(self):
+        """Re-sort each bucket by observed hit frequency.
+
+        Real code is heavily skewed towards a few addressing modes, so
+        after a warm-up period the buckets are reordered with the most
+        frequent entries first (the combined regexes are rebuilt
+        lazily, as usual). Entries are only reordered within the same
+        weight class: the weight order decides which entry wins when
+        more than one regex matches, so it must be preserved.
+        """
+        table = {}
+        for mnemo, bucket in self._table.items():
+            entries = bucket.entries if isinstance(bucket, _Bucket) else bucket
+            table[mnemo] = sorted(entries, key=lambda e: (e.w, -e.hits))
+        self._table = table
+
     @classmethod
     def _load_table(cls):
         table_file = path.join(
             path.dirname(path.realpath(__file__)), "z80table.json")
+        cache_key = (table_file, os.stat(table_file).st_mtime_ns)
+        if cache_key in _TABLE_CACHE:
+            return _TABLE_CACHE[cache_key]
         with open(table_file, "rt") as fd:
             table = json.load(fd)
 
         table.sort(key=lambda o: o["w"])
         res = {}
         for i in table:
-            mnemo = cls._extract_mnemonic(i["case"])
+            entry = cls._make_entry(i)
+            mnemo = cls._extract_mnemonic(entry.case)
             assert mnemo is not None
+            mnemo = sys.intern(mnemo)
             if mnemo not in res:
                 res[mnemo] = []
-            res[mnemo].append(i)
+            res[mnemo].append(entry)
+        _TABLE_CACHE[cache_key] = res
         return res
 
+    @staticmethod
+    def _make_bucket(entries):
+        patterns = ["(?P<e%d>%s)" % (i, entry.regex)
+                    for i, entry in enumerate(entries)]
+        combined = re.compile(
+            r"^\s*(?:" + "|".join(patterns) + r")\s*(?:;.*)?$", re.I)
+        starts = [combined.groupindex["e%d" % i]
+                  for i in range(len(entries))]
+        return _Bucket(entries, combined, starts)
+
     @classmethod
-    def _extract_mnemonic(cls, line):
+    def _parse_line(cls, line):
+        """Split a line into (uppercased mnemonic, line without label),
+        running _LINE_RE only once. Both elements are None if the line
+        doesn't look like an instruction.
+        """
         match = cls._LINE_RE.match(line)
-        if match:
-            return match.group("operator").upper()
-        return None
+        if match is None:
+            return (None, None)
+        operator = match.group("operator")
+        return (operator.upper(), operator + (match.group("rest") or ""))
+
+    @classmethod
+    def _extract_mnemonic(cls, line):
+        return cls._parse_line(line)[0]
 
     @classmethod
     def _remove_label(cls, line):
-        match = cls._LINE_RE.match(line)
-        if match:
-            rest = match.group("rest") or ""
-            return match.group("operator") + rest
-        return None
+        return cls._parse_line(line)[1]
 
     @staticmethod
-    def _init_entry(entry):
-        entry["cregex"] = re.compile(
-            r"^\s*" + entry["regex"] + r"\s*(;.*)?$", re.I)
-        cycles = entry["cycles"]
+    def _make_entry(raw):
+        """Build an ``Entry`` from a raw table (JSON) record."""
+        cycles = raw["cycles"]
         if "/" in cycles:
             c = cycles.split("/")
             t_states_or_not_met = int(c[1])
@@ -389,24 +638,120 @@ class Parser(object):
         else:
             t_states_or_not_met = int(cycles)
             t_states_met = 0
-        entry["_t_states_or_not_met"] = t_states_or_not_met
-        entry["_t_states_met"] = t_states_met
-        entry["_initialized"] = True
+        return Entry(
+            regex=raw["regex"],
+            cycles=cycles,
+            case=raw["case"],
+            w=raw["w"],
+            t_met=t_states_met,
+            t_notmet=t_states_or_not_met,
+        )
+
+
+# output lines accumulated before flushing them in a single writelines
+_WRITE_BATCH = 1024
+
+# size of the input chunks read at once
+_READ_CHUNK = 4 * 1024 * 1024
+
+
+def _read_lines(in_f):
+    """Yield the lines of ``in_f``, reading it in big chunks.
+
+    One C-level read plus str.split is cheaper than the per-line file
+    iterator; a partial line at the end of a chunk is carried over to
+    the next one. Lines are split on "\n" only (not str.splitlines,
+    which also splits on form feeds and other exotic line breaks the
+    file iterator keeps inside the line).
+    """
+    pending = ""
+    while True:
+        data = in_f.read(_READ_CHUNK)
+        if not data:
+            break
+        lines = (pending + data).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+
+# per-worker parser, created once by _init_worker
+_WORKER_PARSER = None
+
+
+def _init_worker():
+    global _WORKER_PARSER
+    _WORKER_PARSER = Parser()
+
+
+def _process_chunk(chunk):
+    lines, no_update, column, use_tabs, tab_width, debug = chunk
+    parser = _WORKER_PARSER
+    total = 0
+    out = []
+    for line in lines:
+        output, total = z80count(
+            line, parser, total, False, no_update,
+            column, use_tabs, tab_width,
+            debug,
+        )
+        out.append(output)
+    return "".join(out)
+
+
+def _main_parallel(in_f, out_f, args):
+    """Annotate the input with a pool of worker processes.
+
+    Only used when subtotals are off: without -s each line's comment
+    is independent of the running total, so the input can be split
+    into chunks, processed in parallel and written back in order.
+    """
+    import concurrent.futures
+
+    lines = list(_read_lines(in_f))
+    chunk_size = max(1, (len(lines) + args.jobs - 1) // args.jobs)
+    chunks = [
+        (lines[i:i + chunk_size], args.no_update, args.column,
+         args.use_tabs, args.tab_width, args.debug)
+        for i in range(0, len(lines), chunk_size)
+    ]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.jobs, initializer=_init_worker) as pool:
+        out_f.writelines(pool.map(_process_chunk, chunks))
 
 
 def main():
     args = get_program_args()
     in_f = args.infile
     out_f = args.outfile
+    if args.jobs > 1 and not args.subt:
+        _main_parallel(in_f, out_f, args)
+        return
     parser = Parser()
     total = 0
-    for line in in_f:
+    buf = []
+    # bind per-line loop lookups to locals
+    subt = args.subt
+    no_update = args.no_update
+    column = args.column
+    use_tabs = args.use_tabs
+    tab_width = args.tab_width
+    debug = args.debug
+    append = buf.append
+    writelines = out_f.writelines
+    for line in _read_lines(in_f):
         output, total = z80count(
-            line, parser, total, args.subt, args.no_update,
-            args.column, args.use_tabs, args.tab_width,
-            args.debug,
+            line, parser, total, subt, no_update,
+            column, use_tabs, tab_width,
+            debug,
         )
-        out_f.write(output)
+        append(output)
+        if len(buf) >= _WRITE_BATCH:
+            writelines(buf)
+            buf.clear()
+    writelines(buf)
 
 if __name__ == "__main__":
     main()